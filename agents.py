@@ -4,14 +4,27 @@ from langchain_core.messages import SystemMessage, AIMessage
 from tools import get_customer_data, calculate_retention_offer, update_customer_status
 from rag import retrieve_context, get_vectorstore
 from schemas import GreeterResponse, RetentionResponse, ProcessorResponse, SupportResponse
+from scheduler import LLMScheduler
+from churn_scoring import get_churn_score
 
 # ── LLM ─────────────────────────────────────────────────
 def get_llm():
     return ChatOpenAI(
         model="gpt-4o-mini",
-        temperature=0.3
+        temperature=0.3,
+        max_retries=0,  # 429s and transient errors are retried by the scheduler
     )
 
+# All agent calls go through one scheduler (rate limits, priority, coalescing).
+# To run the agents offline, set _scheduler = LLMScheduler(lambda: FakeChatModel(...))
+# (test_scheduler.py drives the scheduler the same way).
+_scheduler = None
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler(model_factory=get_llm)
+    return _scheduler
+
 # AGENT 1 — Greeter & Orchestrator
 GREETER_PROMPT = """You are the first point of contact at TechFlow Electronics customer support.
 
@@ -62,9 +75,8 @@ Rules:
 """
 
 def run_greeter(state: dict) -> dict:
-    llm = get_llm().with_structured_output(GreeterResponse)
     messages = [SystemMessage(content=GREETER_PROMPT)] + state["messages"]
-    response = llm.invoke(messages)
+    response = get_scheduler().invoke("greeter", messages, GreeterResponse)
 
     return {
         **state,
@@ -180,16 +192,17 @@ Needs manager: discount over 25%, refunds over $200
 """
 
 def run_retention_agent(state: dict) -> dict:
-    llm = get_llm().with_structured_output(RetentionResponse)
-
     vectorstore = get_vectorstore()
     
     # Fetch customer data
     customer_data = {}
+    churn_score = None
     if state.get("customer_email"):
         result = get_customer_data.invoke(state["customer_email"])
         if "error" not in result:
             customer_data = result
+        # Precomputed by churn_scoring.py: {"rank", "churn_risk"}, or None if unscored
+        churn_score = get_churn_score(state["customer_email"])
     
     # Fetch retention offers
     offers = {}
@@ -207,6 +220,10 @@ def run_retention_agent(state: dict) -> dict:
         query = f"{state.get('cancellation_reason', '')} {state['messages'][-1].content}"
         policy_context = retrieve_context(vectorstore, query)
     
+    churn_line = "Not scored"
+    if churn_score:
+        churn_line = f"{churn_score['churn_risk']:.2f} (rank {churn_score['rank']})"
+
     # Build context block for the agent
     context_block = f"""
 ## Customer Profile
@@ -215,6 +232,10 @@ def run_retention_agent(state: dict) -> dict:
 ## Available Retention Offers
 {offers}
 
+## Churn Risk (batch score, 0-1, higher = more likely to cancel)
+{churn_line}
+Background only — still follow the offer order above and the customer's stated reason.
+
 ## Relevant Policy Context
 {policy_context}
 """
@@ -223,7 +244,7 @@ def run_retention_agent(state: dict) -> dict:
         [SystemMessage(content=RETENTION_PROMPT + "\n\n" + context_block)]
         + state["messages"]
     )
-    response = llm.invoke(messages)
+    response = get_scheduler().invoke("retention_agent", messages, RetentionResponse)
 
     return {
         **state,
@@ -254,20 +275,10 @@ After processing, always end with a clear summary:
 """
 
 def run_processor(state: dict) -> dict:
-    llm = get_llm().with_structured_output(ProcessorResponse)
-
     customer_data = state.get("customer_data", {})
     outcome = state.get("outcome", "CANCEL")
     action = state.get("retention_action", "cancelled")
     
-    # Log the action
-    if customer_data.get("customer_id"):
-        final_action = action if action else "cancelled"
-        update_customer_status.invoke({
-            "customer_id": customer_data["customer_id"],
-            "action": final_action
-        })
-    
     # Fetch relevant policy for processing (refunds, timelines, etc.)
     vectorstore = get_vectorstore()
     policy_context = ""
@@ -286,7 +297,17 @@ def run_processor(state: dict) -> dict:
         [SystemMessage(content=PROCESSOR_PROMPT + "\n\n" + context_block)]
         + state["messages"]
     )
-    response = llm.invoke(messages)
+    response = get_scheduler().invoke("processor", messages, ProcessorResponse)
+
+    # Log the action only once the reply is in hand: if the LLM call fails or
+    # the scheduler is busy, main.py drops the turn and the customer resends,
+    # so logging first would record the action twice.
+    if customer_data.get("customer_id"):
+        final_action = action if action else "cancelled"
+        update_customer_status.invoke({
+            "customer_id": customer_data["customer_id"],
+            "action": final_action
+        })
 
     return {
         **state,
@@ -297,7 +318,6 @@ def run_processor(state: dict) -> dict:
 
 # Non-retention handlers (simple, no tools needed)
 def run_tech_support(state: dict) -> dict:
-    llm = get_llm().with_structured_output(SupportResponse)
     vectorstore = get_vectorstore()
     
     policy_context = ""
@@ -319,7 +339,7 @@ Rules:
 """
     
     messages = [SystemMessage(content=prompt)] + state["messages"]
-    response = llm.invoke(messages)
+    response = get_scheduler().invoke("tech_support", messages, SupportResponse)
     return {
         **state, 
         "messages": [AIMessage(content=response.message)], 
@@ -328,8 +348,6 @@ Rules:
 
 
 def run_billing(state: dict) -> dict:
-    llm = get_llm().with_structured_output(SupportResponse)
-    
     prompt = """You are a billing specialist at TechFlow Electronics.
 Help the customer understand their charges through conversation.
 
@@ -340,7 +358,7 @@ Rules:
 """
     
     messages = [SystemMessage(content=prompt)] + state["messages"]
-    response = llm.invoke(messages)
+    response = get_scheduler().invoke("billing", messages, SupportResponse)
     return {
         **state,
         "messages": [AIMessage(content=response.message)],
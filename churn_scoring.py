@@ -0,0 +1,482 @@
+"""Bulk churn-risk scoring over customers.csv.
+
+Scores every customer in one vectorized pass per chunk and writes a ranked
+churn_scores.csv (highest risk first) with the best agent-approved offer
+from retention_rules.json. main.py loads the scores at startup and
+run_retention_agent reads them through get_churn_score().
+
+Only rank and churn_risk reach the retention prompt. The likely reason and
+offer columns are advisory, for proactive outreach lists. In a live
+conversation the reason comes from the greeter and the offers come from
+tools.calculate_retention_offer.
+
+    python churn_scoring.py                 # score customers.csv
+    python churn_scoring.py --benchmark     # vectorized vs per-row loop
+"""
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+CUSTOMERS_PATH = "customers.csv"
+RULES_PATH = "retention_rules.json"
+SCORES_PATH = "churn_scores.csv"
+CHUNK_ROWS = 100_000
+MAX_BAD_ROWS_REPORTED = 10
+
+# ── Risk model ───────────────────────────────────────────
+# Linear blend, each term normalised to 0..1. Weights sum to 1.
+W_HEALTH = 0.45     # low account_health_score
+W_TICKETS = 0.25    # many support tickets
+W_TENURE = 0.20     # new accounts churn more
+W_CHARGE = 0.10     # price exposure
+MAX_TICKETS = 5
+TENURE_HALF_LIFE_MONTHS = 12
+MAX_CHARGE = 20.0
+
+# Likely reason, used to pick the advisory offer (a heuristic, not a model):
+#   support_tickets_count >= PRODUCT_ISSUE_TICKETS → product_issues
+#   tenure_months < FINANCIAL_TENURE_MONTHS       → financial_hardship
+#   otherwise                                     → service_value
+PRODUCT_ISSUE_TICKETS = 3
+FINANCIAL_TENURE_MONTHS = 6
+
+REASONS = ("financial_hardship", "product_issues", "service_value")
+TIERS = ("premium", "regular", "new")
+TIER_KEYS = ("premium_customers", "regular_customers", "new_customers")
+
+# Same order RETENTION_PROMPT walks through; other offer types rank after these.
+OFFER_PREFERENCE = ("pause", "downgrade", "discount")
+
+NUMERIC_COLUMNS = ("account_health_score", "support_tickets_count", "tenure_months", "monthly_charge")
+TEXT_COLUMNS = ("customer_id", "email", "tier", "status", "plan_type")
+OUTPUT_FIELDS = [
+    "rank", "customer_id", "email", "churn_risk",
+    "likely_reason", "advisory_offer_type", "advisory_offer_description",
+]
+
+
+# ── Offer table ──────────────────────────────────────────
+def _best_agent_offer(offers):
+    """Least disruptive offer an agent can give without a manager."""
+    approved = [o for o in offers if o.get("authorization") == "agent"]
+    if not approved:
+        return None
+    rank = {t: i for i, t in enumerate(OFFER_PREFERENCE)}
+    return min(approved, key=lambda o: rank.get(o.get("type"), len(rank)))
+
+
+def offer_description(offer: dict) -> str:
+    if offer.get("description"):
+        return offer["description"]
+    if offer.get("type") == "downgrade":
+        return f"Downgrade to {offer.get('new_plan', 'basic plan')} (${offer.get('new_cost', 0):.2f}/month)"
+    return offer.get("refund_promise", offer.get("type", ""))
+
+
+def plan_key(plan_type: str) -> str:
+    """'Care+ Premium' -> 'care_plus_premium', the key service_value rules use."""
+    return plan_type.strip().lower().replace("+", "_plus").replace(" ", "_")
+
+
+def build_offer_table(rules: dict):
+    """Return (offers, plans, table) where table[reason, tier, plan] indexes
+    into offers, or -1 if there is no advisory offer. The last plan slot is
+    for plans with no rules of their own.
+
+    - financial_hardship is keyed by tier, falling back to regular like
+      tools.calculate_retention_offer.
+    - service_value is keyed by plan, so only plans listed in the rules get
+      an offer.
+    - product_issues is keyed by the kind of fault (overheating, battery),
+      which the customer table doesn't record, so it gets no offer.
+    """
+    plans = tuple(rules.get("service_value", {}))
+    offers = []
+    table = np.full((len(REASONS), len(TIERS), len(plans) + 1), -1, dtype=np.int16)
+
+    def index_of(offer):
+        if offer is None:
+            return -1
+        if offer not in offers:
+            offers.append(offer)
+        return offers.index(offer)
+
+    hardship = rules.get("financial_hardship", {})
+    for t, tier_key in enumerate(TIER_KEYS):
+        candidates = hardship.get(tier_key) or hardship.get("regular_customers", [])
+        table[REASONS.index("financial_hardship"), t, :] = index_of(_best_agent_offer(candidates))
+
+    for p, plan in enumerate(plans):
+        offer = _best_agent_offer(rules["service_value"][plan])
+        table[REASONS.index("service_value"), :, p] = index_of(offer)
+
+    return offers, plans, table
+
+
+def load_rules(path: str = RULES_PATH) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+# ── Scoring ──────────────────────────────────────────────
+def _codes(values: np.ndarray, vocab, normalize=str.lower) -> np.ndarray:
+    """Map strings to their index in vocab after `normalize` (unknown → -1).
+    Only the handful of distinct values go through Python."""
+    uniques, inverse = np.unique(values, return_inverse=True)
+    keys = [normalize(u) for u in uniques]
+    lookup = np.array([vocab.index(k) if k in vocab else -1 for k in keys], dtype=np.int16)
+    return lookup[inverse.reshape(-1)]
+
+
+def score_columns(cols: dict, plans: tuple, offer_table: np.ndarray):
+    """Vectorized churn risk for one chunk of column arrays.
+
+    Returns (risk, reason_idx, offer_idx). Inactive customers score 0 and
+    get no offer. Unknown tiers fall back to regular.
+    """
+    health = cols["account_health_score"]
+    tickets = cols["support_tickets_count"]
+    tenure = cols["tenure_months"]
+    charge = cols["monthly_charge"]
+
+    risk = (
+        W_HEALTH * np.clip((100.0 - health) / 100.0, 0.0, 1.0)
+        + W_TICKETS * np.minimum(tickets, MAX_TICKETS) / MAX_TICKETS
+        + W_TENURE * np.exp2(-np.maximum(tenure, 0.0) / TENURE_HALF_LIFE_MONTHS)
+        + W_CHARGE * np.clip(charge / MAX_CHARGE, 0.0, 1.0)
+    )
+
+    reason_idx = np.where(
+        tickets >= PRODUCT_ISSUE_TICKETS,
+        REASONS.index("product_issues"),
+        np.where(
+            tenure < FINANCIAL_TENURE_MONTHS,
+            REASONS.index("financial_hardship"),
+            REASONS.index("service_value"),
+        ),
+    )
+    tier_idx = _codes(cols["tier"], TIERS)
+    tier_idx = np.where(tier_idx < 0, TIERS.index("regular"), tier_idx)
+    plan_idx = _codes(cols["plan_type"], plans, plan_key)
+    plan_idx = np.where(plan_idx < 0, len(plans), plan_idx)
+    offer_idx = offer_table[reason_idx, tier_idx, plan_idx]
+
+    active = _codes(cols["status"], ("active",)) == 0
+    risk = np.where(active, risk, 0.0)
+    offer_idx = np.where(active, offer_idx, -1)
+    return risk, reason_idx, offer_idx
+
+
+def _parse_rows(lines, first_line: int, numeric_cols, text_cols, n_fields: int, bad_rows: list):
+    """Slow path for a chunk np.loadtxt rejected: parse row by row and drop
+    the rows that don't convert, recording (file line number, error)."""
+    numeric, text = [], []
+    reader = csv.reader(lines)
+    consumed = 0
+    for row in reader:
+        line_no = first_line + consumed
+        consumed = reader.line_num
+        if len(row) != n_fields:
+            bad_rows.append((line_no, f"expected {n_fields} fields, got {len(row)}"))
+            continue
+        try:
+            values = [float(row[c]) for c in numeric_cols]
+        except ValueError as e:
+            bad_rows.append((line_no, str(e)))
+            continue
+        numeric.append(values)
+        text.append([row[c] for c in text_cols])
+    numeric = np.array(numeric, dtype=np.float64).reshape(-1, len(numeric_cols))
+    text = np.array(text, dtype=object).reshape(-1, len(text_cols))
+    return numeric, text
+
+
+def iter_chunks(path: str = CUSTOMERS_PATH, chunk_rows: int = CHUNK_ROWS, bad_rows: list = None):
+    """Yield dicts of column arrays, at most chunk_rows rows at a time.
+
+    Parsing is done by np.loadtxt's C reader; text columns stay as object
+    arrays since they are only used for lookup and output. Every row must
+    have exactly as many fields as the header. A chunk with a wrong field
+    count or a blank or non-numeric cell is re-parsed row by row and the
+    bad rows are skipped; pass `bad_rows` to collect their (line number, error).
+
+    Records are read one physical line at a time, so quoted fields with
+    embedded newlines are not supported. Such a record shows up as bad rows.
+    """
+    if bad_rows is None:
+        bad_rows = []
+    with open(path, newline="") as f:
+        header = next(csv.reader([f.readline()]))
+        numeric_cols = [header.index(name) for name in NUMERIC_COLUMNS]
+        text_cols = [header.index(name) for name in TEXT_COLUMNS]
+        first_line = 2  # line 1 is the header
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                return
+            try:
+                if all(line.count(",") == len(header) - 1 and '"' not in line for line in lines):
+                    # Unquoted and every row has the header's field count: read only the columns we need.
+                    numeric = np.loadtxt(lines, delimiter=",", usecols=numeric_cols, dtype=np.float64, ndmin=2)
+                    text = np.loadtxt(lines, delimiter=",", usecols=text_cols, dtype=object, ndmin=2)
+                else:
+                    # Quoted fields (or a bad row): read every column so loadtxt
+                    # rejects rows whose field count differs, like _parse_rows.
+                    fields = np.loadtxt(lines, delimiter=",", quotechar='"', dtype=object, ndmin=2)
+                    if fields.shape[1] != len(header):
+                        raise ValueError(f"expected {len(header)} fields, got {fields.shape[1]}")
+                    numeric = fields[:, numeric_cols].astype(np.float64)
+                    text = fields[:, text_cols]
+            except ValueError:
+                numeric, text = _parse_rows(lines, first_line, numeric_cols, text_cols, len(header), bad_rows)
+            first_line += len(lines)
+            if not len(numeric):
+                continue
+            chunk = {name: numeric[:, i] for i, name in enumerate(NUMERIC_COLUMNS)}
+            chunk.update({name: text[:, i] for i, name in enumerate(TEXT_COLUMNS)})
+            yield chunk
+
+
+def score_file(
+    path: str = CUSTOMERS_PATH,
+    out_path: str = SCORES_PATH,
+    rules_path: str = RULES_PATH,
+    chunk_rows: int = CHUNK_ROWS,
+) -> int:
+    """Score every customer and write a ranked CSV. Returns rows written.
+
+    Each chunk is sorted and spilled to a temp file, then the runs are
+    merged, so memory stays at one chunk regardless of file size. Rows
+    that can't be parsed are skipped and reported by line number.
+
+    The result is written to a temp file next to out_path and moved into
+    place with os.replace, so a running app never reads a half-written file.
+    """
+    offers, plans, offer_table = build_offer_table(load_rules(rules_path))
+    offer_types = [o.get("type", "") for o in offers] + [""]          # index -1 → ""
+    offer_descs = [offer_description(o) for o in offers] + [""]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = []
+        bad_rows = []
+        for n, chunk in enumerate(iter_chunks(path, chunk_rows, bad_rows)):
+            risk, reason_idx, offer_idx = score_columns(chunk, plans, offer_table)
+            order = np.argsort(-risk, kind="stable")
+            run_path = os.path.join(tmp, f"run_{n}.csv")
+            with open(run_path, "w", newline="") as f:
+                writer = csv.writer(f)
+                for i in order:
+                    o = offer_idx[i]
+                    writer.writerow([
+                        chunk["customer_id"][i],
+                        chunk["email"][i],
+                        f"{risk[i]:.4f}",
+                        REASONS[reason_idx[i]],
+                        offer_types[o],
+                        offer_descs[o],
+                    ])
+            runs.append(run_path)
+
+        files = [open(p, newline="") for p in runs]
+        out_fd, partial_path = tempfile.mkstemp(
+            prefix=".churn_scores.", suffix=".tmp", dir=os.path.dirname(os.path.abspath(out_path))
+        )
+        try:
+            merged = heapq.merge(*(csv.reader(f) for f in files), key=lambda row: float(row[2]), reverse=True)
+            with open(out_fd, "w", newline="") as out:
+                writer = csv.writer(out)
+                writer.writerow(OUTPUT_FIELDS)
+                rank = 0
+                for rank, row in enumerate(merged, 1):
+                    writer.writerow([rank] + row)
+            os.chmod(partial_path, 0o644)  # mkstemp creates 0600
+            os.replace(partial_path, out_path)
+        except BaseException:
+            os.remove(partial_path)
+            raise
+        finally:
+            for f in files:
+                f.close()
+
+    if bad_rows:
+        print(f"Skipped {len(bad_rows)} unparseable rows in {path}:")
+        for line_no, error in bad_rows[:MAX_BAD_ROWS_REPORTED]:
+            print(f"  line {line_no}: {error}")
+        if len(bad_rows) > MAX_BAD_ROWS_REPORTED:
+            print(f"  ... and {len(bad_rows) - MAX_BAD_ROWS_REPORTED} more")
+    return rank
+
+
+# ── Lookup (used by run_retention_agent) ─────────────────
+# Only rank and churn_risk are kept in memory: that's all the retention
+# prompt shows. main.py loads this at startup; after that, get_churn_score()
+# checks the file's mtime at most every RELOAD_CHECK_SECONDS and, if it
+# changed, reloads in a background thread while serving the old scores.
+RELOAD_CHECK_SECONDS = 30.0
+
+_scores = {}            # lowercase email -> (rank, churn_risk)
+_scores_mtime = None
+_last_check = 0.0
+_reload_lock = threading.Lock()
+
+
+def _file_mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _read_scores(path: str) -> dict:
+    """Parse the ranked file, skipping rows that are short or don't convert.
+    A file without the expected header loads as empty."""
+    scores = {}
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if not all(name in header for name in ("email", "rank", "churn_risk")):
+            print(f"Churn scores: {path} has no email/rank/churn_risk header, ignoring it")
+            return scores
+        e, r, c = header.index("email"), header.index("rank"), header.index("churn_risk")
+        skipped = 0
+        for row in reader:
+            if len(row) != len(header):
+                skipped += 1
+                continue
+            try:
+                scores[row[e].lower()] = (int(row[r]), float(row[c]))
+            except ValueError:
+                skipped += 1
+    if skipped:
+        print(f"Churn scores: skipped {skipped} unparseable rows in {path}")
+    return scores
+
+
+def _load(path: str) -> int:
+    global _scores, _scores_mtime
+    mtime = _file_mtime(path)
+    scores = _read_scores(path) if mtime is not None else {}
+    _scores, _scores_mtime = scores, mtime   # swap in one go; readers never see a half-built dict
+    return len(scores)
+
+
+def load_churn_scores(path: str = SCORES_PATH) -> int:
+    """Load (or reload) the ranked file. Returns customers loaded, 0 if the file is missing."""
+    global _last_check
+    with _reload_lock:
+        _last_check = time.monotonic()
+        return _load(path)
+
+
+def _reload_in_background(path: str):
+    try:
+        _load(path)
+    finally:
+        _reload_lock.release()
+
+
+def _maybe_reload(path: str):
+    global _last_check
+    now = time.monotonic()
+    if now - _last_check < RELOAD_CHECK_SECONDS:
+        return
+    _last_check = now
+    if _file_mtime(path) != _scores_mtime and _reload_lock.acquire(blocking=False):
+        threading.Thread(target=_reload_in_background, args=(path,), daemon=True).start()
+
+
+def get_churn_score(email: str, path: str = SCORES_PATH):
+    """Return {"rank", "churn_risk"} for this email, or None if unscored."""
+    _maybe_reload(path)
+    hit = _scores.get(email.lower())
+    if hit is None:
+        return None
+    return {"rank": hit[0], "churn_risk": hit[1]}
+
+
+# ── Benchmark ────────────────────────────────────────────
+def score_row(row: dict, offers: list, plans: tuple, offer_table) -> tuple:
+    """Naive per-row equivalent of score_columns, for the benchmark."""
+    health = float(row["account_health_score"])
+    tickets = float(row["support_tickets_count"])
+    tenure = float(row["tenure_months"])
+    charge = float(row["monthly_charge"])
+    if row["status"].lower() != "active":
+        return 0.0, None
+    risk = (
+        W_HEALTH * min(max((100.0 - health) / 100.0, 0.0), 1.0)
+        + W_TICKETS * min(tickets, MAX_TICKETS) / MAX_TICKETS
+        + W_TENURE * 2.0 ** (-max(tenure, 0.0) / TENURE_HALF_LIFE_MONTHS)
+        + W_CHARGE * min(max(charge / MAX_CHARGE, 0.0), 1.0)
+    )
+    if tickets >= PRODUCT_ISSUE_TICKETS:
+        reason = "product_issues"
+    elif tenure < FINANCIAL_TENURE_MONTHS:
+        reason = "financial_hardship"
+    else:
+        reason = "service_value"
+    tier = row["tier"].lower()
+    t = TIERS.index(tier) if tier in TIERS else TIERS.index("regular")
+    plan = plan_key(row["plan_type"])
+    p = plans.index(plan) if plan in plans else len(plans)
+    o = offer_table[REASONS.index(reason)][t][p]
+    return risk, offers[o] if o >= 0 else None
+
+
+def run_benchmark(n_rows: int = 1_000_000, path: str = CUSTOMERS_PATH):
+    """Tile customers.csv up to n_rows and time both approaches end to end
+    (parse + score)."""
+    offers, plans, offer_table = build_offer_table(load_rules())
+    table_list = offer_table.tolist()
+
+    with open(path, newline="") as f:
+        lines = f.readlines()
+    header, body = lines[0], lines[1:]
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as tmp:
+        tmp.write(header)
+        for i in range(n_rows):
+            tmp.write(body[i % len(body)])
+        bench_path = tmp.name
+
+    try:
+        start = time.perf_counter()
+        with open(bench_path, newline="") as f:
+            naive = [score_row(row, offers, plans, table_list)[0] for row in csv.DictReader(f)]
+        naive_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vectorized = [score_columns(chunk, plans, offer_table)[0] for chunk in iter_chunks(bench_path)]
+        vector_s = time.perf_counter() - start
+    finally:
+        os.remove(bench_path)
+
+    assert np.allclose(np.concatenate(vectorized), naive)
+    print(f"rows:        {n_rows:,}")
+    print(f"per-row:     {n_rows / naive_s:,.0f} rows/sec ({naive_s:.2f}s)")
+    print(f"vectorized:  {n_rows / vector_s:,.0f} rows/sec ({vector_s:.2f}s)")
+    print(f"speedup:     {naive_s / vector_s:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk churn-risk scoring")
+    parser.add_argument("--input", default=CUSTOMERS_PATH)
+    parser.add_argument("--output", default=SCORES_PATH)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--benchmark-rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark_rows, args.input)
+    else:
+        start = time.perf_counter()
+        n = score_file(args.input, args.output, chunk_rows=args.chunk_rows)
+        print(f"Scored {n:,} customers in {time.perf_counter() - start:.2f}s → {args.output}")
@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage, AIMessage
 from graph import build_graph
 from rag import get_vectorstore
+from scheduler import SchedulerBusy
+from churn_scoring import load_churn_scores
 
 load_dotenv()
 
@@ -10,6 +12,10 @@ def run_chat():
     print("🔧 Loading RAG vectorstore from policy docs...")
     get_vectorstore()  # pre-load once
 
+    print("Loading churn scores...")
+    scored = load_churn_scores()
+    print(f"Churn scores: {scored} customers" if scored else "Churn scores: none (run churn_scoring.py)")
+
     print("Building agent graph...")
     graph = build_graph()
 
@@ -44,6 +50,11 @@ def run_chat():
         # Run the graph
         try:
             result = graph.invoke(state)
+        except SchedulerBusy:
+            # Backpressure: drop this turn so the customer can resend it
+            state["messages"] = state["messages"][:-1]
+            print("\nAgent: We're handling a lot of conversations right now — please send that again in a moment.\n")
+            continue
         except Exception as e:
             print(f"❌ Error: {e}")
             continue
@@ -0,0 +1,448 @@
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# ── Limits ───────────────────────────────────────────────
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+MAX_QUEUE_SIZE = 64          # pending calls before we push back on the front end
+QUEUE_BLOCK_TIMEOUT = 2.0    # seconds a caller waits for a free slot before SchedulerBusy
+NUM_WORKERS = 4
+MAX_RETRIES = 4
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_CAP = 30.0
+RETRY_AFTER_MAX = 60.0       # longer server-requested delays fall back to backoff
+OUTPUT_TOKEN_BUDGET = 512    # reserved per call for the structured reply
+BURST_SECONDS = 60.0         # bucket holds this many seconds of quota (60 = a full minute)
+
+# Lower number = served first. A customer mid-cancellation should never
+# wait behind a routine billing question.
+AGENT_PRIORITIES = {
+    "retention_agent": 0,
+    "processor": 1,
+    "greeter": 2,
+    "tech_support": 3,
+    "billing": 4,
+}
+DEFAULT_PRIORITY = 5
+
+WAIT_TIME_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+class SchedulerBusy(Exception):
+    """Raised when the LLM queue is full. The front end should ask the customer to retry."""
+
+
+# ── Building blocks ──────────────────────────────────────
+class TokenBucket:
+    """Refills continuously at `per_minute / 60` per second, capped at
+    `burst_seconds` worth of refill (a full minute by default).
+    Not thread-safe on its own — LLMScheduler only touches it under its lock."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = self.rate * burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class Histogram:
+    """Cumulative-style bucket counts, same shape as a Prometheus histogram."""
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        buckets = {}
+        running = 0
+        for bound, n in zip(self.bounds + ("+Inf",), self.counts):
+            running += n
+            buckets[f"le_{bound}"] = running
+        return {"count": self.count, "sum": round(self.total, 4), "buckets": buckets}
+
+
+class _Request:
+    __slots__ = ("agent", "priority", "seq", "messages", "schema", "key",
+                 "tokens", "future", "enqueued_at", "attempts")
+
+    def __init__(self, agent, priority, seq, messages, schema, key, tokens):
+        self.agent = agent
+        self.priority = priority
+        self.seq = seq
+        self.messages = messages
+        self.schema = schema
+        self.key = key
+        self.tokens = tokens
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _message_parts(messages) -> list:
+    return [(getattr(m, "type", ""), str(getattr(m, "content", m))) for m in messages]
+
+
+def request_key(messages, schema=None) -> str:
+    """Identical prompts with the same output schema coalesce onto one call."""
+    payload = json.dumps([getattr(schema, "__name__", ""), _message_parts(messages)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(messages) -> int:
+    """Rough prompt size (~4 chars/token) plus the reply budget."""
+    chars = sum(len(content) for _, content in _message_parts(messages))
+    return chars // 4 + OUTPUT_TOKEN_BUDGET
+
+
+# What the OpenAI client would have retried itself (it runs with max_retries=0).
+RETRYABLE_STATUS = {408, 409, 429}
+RETRYABLE_ERRORS = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError"}
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after_seconds(error: Exception):
+    """Delay the server asked for, or None to use exponential backoff.
+
+    openai.APIStatusError carries it in the retry-after-ms / retry-after
+    headers of error.response. Like the client, values over
+    RETRY_AFTER_MAX are ignored. FakeRateLimitError sets retry_after directly.
+    """
+    explicit = getattr(error, "retry_after", None)
+    if explicit is not None:
+        return float(explicit)
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+
+    seconds = None
+    if headers.get("retry-after-ms"):
+        try:
+            seconds = float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if seconds is None and headers.get("retry-after"):
+        value = headers["retry-after"]
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:  # HTTP-date form
+                seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    if seconds is None or not 0 <= seconds <= RETRY_AFTER_MAX:
+        return None
+    return seconds
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """429s plus transient failures: timeouts, connection errors, 408/409, 5xx."""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int) and (status in RETRYABLE_STATUS or status >= 500):
+        return True
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+# ── Scheduler ────────────────────────────────────────────
+class LLMScheduler:
+    """Single gateway for every agent LLM call.
+
+    Calls are queued by agent priority, released only when both the
+    requests/min and tokens/min buckets allow it, and retried with backoff
+    on 429s and transient API errors. Identical in-flight requests share one Future.
+    """
+
+    def __init__(
+        self,
+        model_factory,
+        requests_per_minute: int = REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = TOKENS_PER_MINUTE,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+        num_workers: int = NUM_WORKERS,
+        max_retries: int = MAX_RETRIES,
+        burst_seconds: float = BURST_SECONDS,
+    ):
+        self._model_factory = model_factory
+        self._model = None
+        self._rpm = TokenBucket(requests_per_minute, burst_seconds)
+        self._tpm = TokenBucket(tokens_per_minute, burst_seconds)
+        self._max_queue_size = max_queue_size
+        self._num_workers = num_workers
+        self._max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._inflight = {}          # request key -> _Request
+        self._cooldown_until = 0.0   # set on 429/5xx so every worker backs off
+        self._workers = []
+
+        self._queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+        self._wait_times = {}        # agent -> Histogram
+        self._counters = {
+            "submitted": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "rate_limited": 0,
+            "retried": 0,
+            "completed": 0,
+            "failed": 0,
+        }
+
+    # ── Public API ──
+    def submit(self, agent: str, messages, schema=None, block_timeout: float = QUEUE_BLOCK_TIMEOUT) -> Future:
+        """Queue a call and return its Future. Raises SchedulerBusy if the
+        queue stays full for `block_timeout` seconds."""
+        key = request_key(messages, schema)
+        deadline = time.monotonic() + block_timeout
+
+        with self._cond:
+            self._start_workers()
+            self._counters["submitted"] += 1
+            while True:
+                existing = self._inflight.get(key)
+                if existing is not None:
+                    self._counters["coalesced"] += 1
+                    return existing.future
+                if len(self._heap) < self._max_queue_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["rejected"] += 1
+                    raise SchedulerBusy(
+                        f"LLM queue full ({self._max_queue_size} pending) — try again shortly"
+                    )
+                self._cond.wait(remaining)
+
+            priority = AGENT_PRIORITIES.get(agent, DEFAULT_PRIORITY)
+            req = _Request(agent, priority, next(self._seq), messages, schema, key, estimate_tokens(messages))
+            heapq.heappush(self._heap, req)
+            self._inflight[key] = req
+            self._queue_depth.observe(len(self._heap))
+            self._cond.notify_all()
+            return req.future
+
+    def invoke(self, agent: str, messages, schema=None, timeout: float = None):
+        """Blocking helper used by the agents: submit and wait for the result."""
+        return self.submit(agent, messages, schema).result(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queue_depth": len(self._heap),
+                "in_flight": len(self._inflight),
+                **self._counters,
+                "queue_depth_histogram": self._queue_depth.snapshot(),
+                "wait_time_histograms": {
+                    agent: hist.snapshot() for agent, hist in self._wait_times.items()
+                },
+            }
+
+    # ── Internals ──
+    def _start_workers(self):
+        if self._workers:
+            return
+        for i in range(self._num_workers):
+            t = threading.Thread(target=self._worker, name=f"llm-scheduler-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def _get_model(self):
+        with self._cond:
+            if self._model is None:
+                self._model = self._model_factory()
+            return self._model
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                req = self._next_request()
+            self._dispatch(req)
+
+    def _next_request(self) -> _Request:
+        """Pop the highest-priority request once the rate limits allow it.
+        Must be called with the lock held. Re-checks the head after every
+        wait so a retention call arriving mid-wait jumps the line."""
+        while True:
+            if not self._heap:
+                self._cond.wait()
+                continue
+            now = time.monotonic()
+            req = self._heap[0]
+            wait = max(
+                self._cooldown_until - now,
+                self._rpm.wait_time(1, now),
+                self._tpm.wait_time(req.tokens, now),
+            )
+            if wait > 0:
+                self._cond.wait(wait)
+                continue
+            heapq.heappop(self._heap)
+            self._rpm.consume(1)
+            self._tpm.consume(req.tokens)
+            if req.attempts == 0:
+                hist = self._wait_times.setdefault(req.agent, Histogram(WAIT_TIME_BUCKETS))
+                hist.observe(now - req.enqueued_at)
+            self._cond.notify_all()  # a queue slot just freed up
+            return req
+
+    def _dispatch(self, req: _Request):
+        try:
+            model = self._get_model()
+            if req.schema is not None:
+                model = model.with_structured_output(req.schema)
+            result = model.invoke(req.messages)
+        except Exception as e:
+            if is_retryable_error(e) and req.attempts < self._max_retries:
+                self._retry(req, e)
+            else:
+                self._finish(req, error=e)
+            return
+        self._finish(req, result=result)
+
+    def _retry(self, req: _Request, error: Exception):
+        with self._cond:
+            req.attempts += 1
+            self._counters["retried"] += 1
+            if is_rate_limit_error(error):
+                self._counters["rate_limited"] += 1
+            backoff = retry_after_seconds(error)
+            if backoff is None:
+                backoff = min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** (req.attempts - 1))
+                backoff *= random.uniform(0.5, 1.0)
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + backoff)
+            # Same (priority, seq) so the retry keeps its original place in line.
+            heapq.heappush(self._heap, req)
+            self._cond.notify_all()
+
+    def _finish(self, req: _Request, result=None, error: Exception = None):
+        with self._cond:
+            self._inflight.pop(req.key, None)
+            self._counters["failed" if error is not None else "completed"] += 1
+        if error is not None:
+            req.future.set_exception(error)
+        else:
+            req.future.set_result(result)
+
+
+# ── Fake model (local testing, no API key) ───────────────
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: float = None):
+        super().__init__("429 Too Many Requests (simulated)")
+        self.retry_after = retry_after
+
+
+_FIELD_DEFAULTS = {str: "", bool: False, int: 0, float: 0.0}
+
+
+def _default_response(schema):
+    return schema(**{
+        name: _FIELD_DEFAULTS.get(field.annotation)
+        for name, field in schema.model_fields.items()
+    })
+
+
+class FakeChatModel:
+    """Drop-in stand-in for ChatOpenAI. Sleeps to simulate latency and raises
+    a 429 on roughly `rate_limit_rate` of calls.
+
+    `responder(messages, schema)` can return a canned reply; otherwise the
+    schema is filled with empty defaults.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, rate_limit_rate=0.0, retry_after=None, responder=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.responder = responder
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def with_structured_output(self, schema):
+        return _FakeStructuredModel(self, schema)
+
+    def invoke(self, messages, schema=None):
+        with self._lock:
+            self.calls += 1
+            throttled = self._rng.random() < self.rate_limit_rate
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        if throttled:
+            raise FakeRateLimitError(self.retry_after)
+        if self.responder is not None:
+            return self.responder(messages, schema)
+        if schema is not None:
+            return _default_response(schema)
+        return "ok"
+
+
+class _FakeStructuredModel:
+    def __init__(self, model, schema):
+        self._model = model
+        self._schema = schema
+
+    def invoke(self, messages):
+        return self._model.invoke(messages, self._schema)
+
+
+if __name__ == "__main__":
+    # Load test against the fake model: flood billing, then watch retention cut in.
+    fake = FakeChatModel(latency=0.05, rate_limit_rate=0.15, retry_after=0.2, seed=7)
+    scheduler = LLMScheduler(lambda: fake, requests_per_minute=600, max_queue_size=200, num_workers=4)
+
+    futures = []
+    for i in range(60):
+        futures.append(scheduler.submit("billing", [f"billing question {i}"]))
+    for i in range(5):
+        futures.append(scheduler.submit("retention_agent", [f"I want to cancel {i}"]))
+    # duplicates coalesce onto the already-queued calls
+    for i in range(5):
+        futures.append(scheduler.submit("retention_agent", [f"I want to cancel {i}"]))
+
+    for f in futures:
+        f.result()
+
+    stats = scheduler.stats()
+    print(f"model calls: {fake.calls}")
+    print(json.dumps(stats, indent=2))
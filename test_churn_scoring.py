@@ -0,0 +1,146 @@
+import csv
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+import churn_scoring
+from churn_scoring import REASONS, TIERS, build_offer_table, load_rules, score_file
+
+HERE = Path(__file__).parent
+CUSTOMERS = HERE / "customers.csv"
+RULES = HERE / "retention_rules.json"
+
+
+@pytest.fixture(autouse=True)
+def fresh_lookup(monkeypatch):
+    monkeypatch.setattr(churn_scoring, "_scores", {})
+    monkeypatch.setattr(churn_scoring, "_scores_mtime", None)
+    monkeypatch.setattr(churn_scoring, "_last_check", 0.0)
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def write_customers(path, edit):
+    """Copy customers.csv to path after edit(lines) changes its lines in place."""
+    lines = CUSTOMERS.read_text().splitlines()
+    edit(lines)
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_small_chunks_match_single_chunk(tmp_path):
+    chunked, whole = tmp_path / "chunked.csv", tmp_path / "whole.csv"
+    score_file(CUSTOMERS, chunked, RULES, chunk_rows=3)
+    score_file(CUSTOMERS, whole, RULES)
+
+    assert chunked.read_bytes() == whole.read_bytes()
+    rows = read_rows(whole)
+    assert [int(r["rank"]) for r in rows] == list(range(1, len(rows) + 1))
+    risks = [float(r["churn_risk"]) for r in rows]
+    assert risks == sorted(risks, reverse=True)
+
+
+def test_bad_row_is_skipped_and_reported_with_file_line(tmp_path, capsys):
+    src = tmp_path / "customers.csv"
+
+    def blank_tickets(lines):
+        lines[3] = lines[3].replace(",1,92,", ",,92,")   # CUST_003, file line 4
+
+    write_customers(src, blank_tickets)
+    out = tmp_path / "scores.csv"
+    written = score_file(src, out, RULES, chunk_rows=4)
+
+    assert written == 9
+    assert "CUST_003" not in {r["customer_id"] for r in read_rows(out)}
+    assert "line 4:" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 3, 100])
+def test_extra_field_rejected_regardless_of_chunk(tmp_path, chunk_rows):
+    src = tmp_path / "customers.csv"
+
+    def extra_field(lines):
+        lines[5] += ",EXTRA"   # file line 6
+
+    write_customers(src, extra_field)
+
+    bad_rows = []
+    scored = sum(len(c["email"]) for c in churn_scoring.iter_chunks(src, chunk_rows, bad_rows))
+    assert scored == 9
+    assert [line for line, _ in bad_rows] == [6]
+
+
+def test_multiline_record_keeps_later_line_numbers(tmp_path):
+    src = tmp_path / "customers.csv"
+
+    def break_rows(lines):
+        lines[3:3] = ['CUST_X,"broken', 'name",x']                 # lines 4-5
+        lines[7] = lines[7].replace(",4,78,", ",abc,78,")         # CUST_005, line 8
+
+    write_customers(src, break_rows)
+    bad_rows = []
+    list(churn_scoring.iter_chunks(src, 100, bad_rows))
+    assert [line for line, _ in bad_rows] == [4, 8]
+
+
+def test_offer_table_indexing():
+    offers, plans, table = build_offer_table(load_rules(RULES))
+
+    def offer(reason, tier, plan):
+        p = plans.index(plan) if plan in plans else len(plans)
+        i = table[REASONS.index(reason), TIERS.index(tier), p]
+        return None if i < 0 else offers[i]["type"]
+
+    assert offer("financial_hardship", "regular", "care_plus_basic") == "pause"
+    assert offer("financial_hardship", "new", "care_plus_basic") == "discount"
+    assert offer("service_value", "premium", "care_plus_premium") == "downgrade"
+    assert offer("service_value", "premium", "care_plus_basic") is None
+    assert offer("product_issues", "premium", "care_plus_premium") is None
+
+
+def test_get_churn_score_returns_rank_and_risk(tmp_path):
+    out = tmp_path / "scores.csv"
+    score_file(CUSTOMERS, out, RULES)
+    expected = next(r for r in read_rows(out) if r["email"] == "lisa.kim@email.com")
+
+    assert churn_scoring.load_churn_scores(out) == 10
+    assert churn_scoring.get_churn_score("LISA.KIM@email.com", out) == {
+        "rank": int(expected["rank"]),
+        "churn_risk": float(expected["churn_risk"]),
+    }
+    assert churn_scoring.get_churn_score("nobody@example.com", out) is None
+
+
+def test_missing_file_loads_empty(tmp_path):
+    assert churn_scoring.load_churn_scores(tmp_path / "absent.csv") == 0
+    assert churn_scoring.get_churn_score("lisa.kim@email.com", tmp_path / "absent.csv") is None
+
+
+def test_truncated_file_skips_the_partial_row(tmp_path):
+    out = tmp_path / "scores.csv"
+    score_file(CUSTOMERS, out, RULES)
+    data = out.read_text()
+    cut = tmp_path / "trunc.csv"
+    cut.write_text(data[: data.index("\n", 200) - 5])   # stop mid-row
+
+    loaded = churn_scoring.load_churn_scores(cut)
+    assert 0 < loaded < 10
+
+
+def test_changed_file_reloads_in_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(churn_scoring, "RELOAD_CHECK_SECONDS", 0.0)
+    out = tmp_path / "scores.csv"
+    assert churn_scoring.load_churn_scores(out) == 0
+
+    score_file(CUSTOMERS, out, RULES)
+    os.utime(out, ns=(time.time_ns(), time.time_ns() + 10**9))   # make sure mtime moves
+
+    deadline = time.monotonic() + 5
+    while churn_scoring.get_churn_score("lisa.kim@email.com", out) is None:
+        assert time.monotonic() < deadline, "scores were not reloaded"
+        time.sleep(0.01)
+    assert len(churn_scoring._scores) == 10
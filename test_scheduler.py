@@ -0,0 +1,296 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import scheduler
+from scheduler import FakeChatModel, FakeRateLimitError, LLMScheduler, SchedulerBusy, TokenBucket
+
+
+class GatedResponder:
+    """Records call order. A call whose prompt is ["gate"] blocks until
+    release(), which keeps the single worker busy while the test queues work."""
+
+    def __init__(self):
+        self.order = []
+        self.started = threading.Event()
+        self._gate = threading.Event()
+
+    def __call__(self, messages, schema):
+        self.order.append(messages[0])
+        if messages[0] == "gate":
+            self.started.set()
+            self._gate.wait(5)
+        return f"reply to {messages[0]}"
+
+    def release(self):
+        self._gate.set()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(scheduler, "RETRY_BACKOFF_BASE", 0.001)
+
+
+def make_scheduler(responder=None, **kwargs):
+    fake = FakeChatModel(latency=0, jitter=0, responder=responder)
+    kwargs.setdefault("num_workers", 1)
+    return LLMScheduler(lambda: fake, **kwargs), fake
+
+
+def occupy_worker(sched, responder):
+    gate = sched.submit("billing", ["gate"])
+    assert responder.started.wait(5)
+    return gate
+
+
+def test_retention_jumps_ahead_of_queued_billing():
+    responder = GatedResponder()
+    sched, _ = make_scheduler(responder)
+    gate = occupy_worker(sched, responder)
+
+    futures = [sched.submit("billing", [f"billing {i}"]) for i in range(3)]
+    futures.append(sched.submit("retention_agent", ["cancel"]))
+    responder.release()
+    for f in [gate] + futures:
+        f.result(5)
+
+    assert responder.order == ["gate", "cancel", "billing 0", "billing 1", "billing 2"]
+
+
+def test_identical_prompts_share_one_model_call():
+    responder = GatedResponder()
+    sched, fake = make_scheduler(responder)
+    gate = occupy_worker(sched, responder)
+
+    first = sched.submit("greeter", ["hello"])
+    second = sched.submit("greeter", ["hello"])
+    responder.release()
+
+    assert first is second
+    assert first.result(5) == "reply to hello"
+    gate.result(5)
+    assert fake.calls == 2  # gate + one shared call
+    assert sched.stats()["coalesced"] == 1
+
+
+def test_full_queue_raises_scheduler_busy():
+    responder = GatedResponder()
+    sched, _ = make_scheduler(responder, max_queue_size=1)
+    gate = occupy_worker(sched, responder)
+
+    queued = sched.submit("billing", ["queued"])
+    with pytest.raises(SchedulerBusy):
+        sched.submit("billing", ["overflow"], block_timeout=0.05)
+    responder.release()
+
+    gate.result(5)
+    queued.result(5)
+    assert sched.stats()["rejected"] == 1
+
+
+def test_rate_limited_call_is_retried_until_it_succeeds():
+    attempts = []
+
+    def responder(messages, schema):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeRateLimitError(retry_after=0)
+        return "ok"
+
+    sched, _ = make_scheduler(responder)
+    assert sched.invoke("retention_agent", ["cancel"], timeout=5) == "ok"
+
+    stats = sched.stats()
+    assert stats["rate_limited"] == 2
+    assert stats["completed"] == 1
+    assert stats["failed"] == 0
+
+
+def test_rate_limited_call_fails_after_max_retries():
+    def responder(messages, schema):
+        raise FakeRateLimitError(retry_after=0)
+
+    sched, fake = make_scheduler(responder, max_retries=2)
+    with pytest.raises(FakeRateLimitError):
+        sched.invoke("billing", ["charges"], timeout=5)
+
+    stats = sched.stats()
+    assert fake.calls == 3  # first try + 2 retries
+    assert stats["rate_limited"] == 2
+    assert stats["failed"] == 1
+
+
+class ServerError(Exception):
+    status_code = 500
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def test_transient_server_error_is_retried():
+    attempts = []
+
+    def responder(messages, schema):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ServerError("upstream 500")
+        return "ok"
+
+    sched, _ = make_scheduler(responder)
+    assert sched.invoke("tech_support", ["no signal"], timeout=5) == "ok"
+
+    stats = sched.stats()
+    assert stats["retried"] == 1
+    assert stats["rate_limited"] == 0
+
+
+def test_client_error_is_not_retried():
+    def responder(messages, schema):
+        raise BadRequest("invalid request")
+
+    sched, fake = make_scheduler(responder)
+    with pytest.raises(BadRequest):
+        sched.invoke("billing", ["charges"], timeout=5)
+    assert fake.calls == 1
+    assert sched.stats()["failed"] == 1
+
+
+def test_wait_time_histograms_count_each_call_per_agent():
+    sched, _ = make_scheduler(num_workers=2)
+    futures = [sched.submit("billing", [f"billing {i}"]) for i in range(4)]
+    futures += [sched.submit("retention_agent", [f"cancel {i}"]) for i in range(2)]
+    for f in futures:
+        f.result(5)
+
+    waits = sched.stats()["wait_time_histograms"]
+    assert waits["billing"]["count"] == 4
+    assert waits["billing"]["buckets"]["le_+Inf"] == 4
+    assert waits["retention_agent"]["count"] == 2
+    assert waits["retention_agent"]["buckets"]["le_+Inf"] == 2
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class OpenAIStyleRateLimit(Exception):
+    """Shaped like openai.RateLimitError: the delay lives in response headers."""
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__("429")
+        self.response = FakeResponse(headers)
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "250"}, 0.25),
+    ({"retry-after": "2"}, 2.0),
+    ({"retry-after-ms": "250", "retry-after": "2"}, 0.25),
+    ({"retry-after": "3600"}, None),       # too long: fall back to backoff
+    ({"retry-after": "soon"}, None),
+    ({}, None),
+])
+def test_retry_after_read_from_response_headers(headers, expected):
+    assert scheduler.retry_after_seconds(OpenAIStyleRateLimit(headers)) == expected
+
+
+def test_retry_after_http_date():
+    when = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    delay = scheduler.retry_after_seconds(OpenAIStyleRateLimit({"retry-after": when}))
+    assert 25 < delay <= 30
+
+
+def test_scheduler_waits_for_retry_after_header():
+    calls = []
+
+    def responder(messages, schema):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise OpenAIStyleRateLimit({"retry-after-ms": "200"})
+        return "ok"
+
+    sched, _ = make_scheduler(responder)
+    assert sched.invoke("billing", ["charges"], timeout=5) == "ok"
+    assert calls[1] - calls[0] >= 0.19
+
+
+# ── Rate limits ──────────────────────────────────────────
+def test_token_bucket_starts_full_and_refills_at_per_minute_rate():
+    bucket = TokenBucket(60)            # 1 token/sec, 60 capacity
+    t0 = bucket.updated
+    assert bucket.wait_time(60, t0) == 0.0
+
+    bucket.consume(60)
+    assert bucket.wait_time(1, t0) == pytest.approx(1.0)
+    assert bucket.wait_time(1, t0 + 0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(1, t0 + 1.0) == 0.0
+
+
+def test_token_bucket_refill_is_capped():
+    bucket = TokenBucket(60, burst_seconds=2)    # capacity 2
+    t0 = bucket.updated
+    bucket.consume(2)
+    bucket.wait_time(1, t0 + 100)               # long idle
+    assert bucket.tokens == pytest.approx(2.0)
+
+
+def test_token_bucket_clamps_requests_larger_than_capacity():
+    bucket = TokenBucket(60, burst_seconds=1)    # capacity 1
+    t0 = bucket.updated
+    assert bucket.wait_time(10, t0) == 0.0      # treated as a full bucket
+    bucket.consume(10)
+    assert bucket.tokens == pytest.approx(0.0)
+    assert bucket.wait_time(10, t0) == pytest.approx(1.0)
+
+
+def dispatch_times(responder_log):
+    def responder(messages, schema):
+        responder_log.append((messages[0], time.monotonic()))
+        return "ok"
+    return responder
+
+
+def test_second_call_waits_for_requests_per_minute():
+    log = []
+    # 600 rpm with a 0.1s burst: one call fits, the next refills after ~0.1s.
+    sched, _ = make_scheduler(dispatch_times(log), requests_per_minute=600, burst_seconds=0.1)
+    sched.invoke("billing", ["first"], timeout=5)
+    sched.invoke("billing", ["second"], timeout=5)
+
+    assert log[1][1] - log[0][1] >= 0.08
+    assert sched.stats()["wait_time_histograms"]["billing"]["sum"] >= 0.08
+
+
+def test_second_call_waits_for_tokens_per_minute():
+    log = []
+    prompt = "x" * 400   # ~100 prompt tokens + the reply budget
+    tokens = scheduler.estimate_tokens([prompt])
+    # The bucket holds exactly one call's tokens and refills it in ~0.1s.
+    sched, _ = make_scheduler(
+        dispatch_times(log),
+        tokens_per_minute=tokens * 600,
+        burst_seconds=0.1,
+    )
+    sched.invoke("billing", [prompt + "1"], timeout=5)
+    sched.invoke("billing", [prompt + "2"], timeout=5)
+
+    assert log[1][1] - log[0][1] >= 0.08
+
+
+def test_retention_goes_first_once_the_limit_allows_a_call():
+    log = []
+    sched, _ = make_scheduler(dispatch_times(log), requests_per_minute=600, burst_seconds=0.1)
+    sched.invoke("billing", ["billing 0"], timeout=5)   # uses the only token
+    queued = [sched.submit("billing", [f"billing {i}"]) for i in (1, 2)]
+    queued.append(sched.submit("retention_agent", ["cancel"]))
+    for f in queued:
+        f.result(5)
+
+    assert [name for name, _ in log] == ["billing 0", "cancel", "billing 1", "billing 2"]
+    gaps = [b - a for (_, a), (_, b) in zip(log, log[1:])]
+    assert all(gap >= 0.08 for gap in gaps)